@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from board import Board
+from montecarlo import MCTS
+
+# --- constants ---
+
+SAVE_EXTENSION = ".othello"
+
+# --- functions ---
+
+def find_games(paths):
+    # lazily yields every save file in the given files and directories, so the full list of
+    # games is never held in memory
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, folders, files in os.walk(path):
+                folders.sort()
+                for name in sorted(files):
+                    if name.endswith(SAVE_EXTENSION):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+def load_game(path):
+    # reads a save file in the same order it is written by 'Game.save'
+    with open(path, "rb") as file:
+        active_player = pickle.load(file)
+        players = [pickle.load(file), pickle.load(file)]
+        board = pickle.load(file)
+    return active_player, players, board
+
+def positions(path):
+    # yields a task for each position in a saved game
+    # the moves leading to the position are sent rather than the board itself, as they are much
+    # smaller to send to a worker process
+    active_player, players, board = load_game(path)
+    history = getattr(board, "history", None)
+
+    if history is None:
+        # games saved before move histories were recorded can only have their final position analysed
+        yield (path, 0, 1, None, board, players[active_player].colour)
+        return
+
+    # each task also carries the number of positions in the game, so a resumed analysis can tell
+    # which games are finished
+    total = len(history) + 1
+    for ply, (move, colour) in enumerate(history):
+        yield (path, ply, total, history[:ply], None, colour)
+
+    # the position after the last move is analysed for the player whose turn it is in the save file
+    yield (path, len(history), total, history, None, players[active_player].colour)
+
+def analyse_position(task, iterations):
+    # runs in a worker process, rebuilds the position and searches it
+    path, ply, total, moves, board, colour = task
+
+    if board is None:
+        board = Board()
+        for move, move_colour in moves:
+            board.place_disk(tuple(move), move_colour)
+
+    result = {
+        "file" : path,
+        "ply" : ply,
+        "positions" : total,
+        "colour" : colour,
+        "best_move" : None,
+        "evaluation" : None,
+        "visits" : 0
+    }
+
+    game_tree = MCTS(iterations, colour)
+    move, stats = game_tree.search(board, with_stats=True)
+    if move is not None:
+        # the evaluation is the proportion of simulated games won after playing the best move
+        child = game_tree.root.children[move]
+        result["best_move"] = list(move)
+        result["evaluation"] = child.w / child.n
+        result["visits"] = child.n
+    result["iterations_per_second"] = stats.iterations_per_second()
+    return result
+
+def completed_positions(output):
+    # reads an existing output file line by line so an interrupted analysis can be resumed
+    # returns the files whose every position has been analysed, and the plies already analysed
+    # in each file that hasn't been finished, so only unfinished files hold a set of plies
+    complete = set()
+    partial = {}
+    if not os.path.exists(output):
+        return complete, partial
+
+    with open(output, "rb+") as file:
+        end = 0
+        for line in file:
+            if not line.endswith(b"\n"):
+                # a partially written last line is removed so new results start on a fresh line
+                file.truncate(end)
+                break
+            end += len(line)
+
+            # lines that can't be read, or that are missing any of the fields used here, are skipped
+            # so those positions are analysed again
+            try:
+                result = json.loads(line)
+                path, ply, total = result["file"], result["ply"], int(result["positions"])
+                if path in complete:
+                    continue
+                plies = partial.setdefault(path, set())
+                plies.add(ply)
+            except (ValueError, KeyError, TypeError, OverflowError):
+                continue
+
+            if len(plies) >= total:
+                complete.add(path)
+                del partial[path]
+
+    return complete, partial
+
+def analyse(paths, output, iterations=100, workers=None, max_in_flight=None, resume=True):
+    # searches every position in every game, writing each result as a json line as soon as it finishes
+    complete, partial = completed_positions(output) if resume else (set(), {})
+    mode = "a" if resume else "w"
+
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(output, mode) as file:
+        # the number of unfinished searches is capped so memory use doesn't grow with the input
+        if max_in_flight is None:
+            max_in_flight = (workers or os.cpu_count() or 1) * 2
+        in_flight = set()
+        written = 0
+
+        for path in find_games(paths):
+            if path in complete:
+                continue
+            done = partial.pop(path, set())
+
+            try:
+                tasks = positions(path)
+                for task in tasks:
+                    if task[1] in done:
+                        continue
+
+                    if len(in_flight) >= max_in_flight:
+                        finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                        written += write_results(file, finished)
+
+                    in_flight.add(executor.submit(analyse_position, task, iterations))
+            except (OSError, EOFError, pickle.UnpicklingError) as error:
+                # invalid save files are skipped rather than stopping the whole analysis
+                print("Skipping {0}: {1}".format(path, error))
+
+        finished, in_flight = wait(in_flight)
+        written += write_results(file, finished)
+
+    return written
+
+def write_results(file, futures):
+    for future in futures:
+        file.write(json.dumps(future.result()) + "\n")
+
+    # flushed after every batch so results survive an interruption
+    file.flush()
+    return len(futures)
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate saved games with the engine's evaluation")
+    parser.add_argument("paths", nargs="+", help="save files or directories containing them")
+    parser.add_argument("-o", "--output", default="analysis.jsonl")
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--restart", action="store_true", help="ignore existing results in the output file")
+    args = parser.parse_args()
+
+    written = analyse(args.paths, args.output, args.iterations, args.workers, args.max_in_flight,
+                      not args.restart)
+    print("{0} positions analysed".format(written))
@@ -0,0 +1,106 @@
+import argparse
+import copy
+import json
+import random
+import sys
+import time
+from board import Board
+from montecarlo import MCTS
+
+# --- functions ---
+
+def opening_position(plies, seed):
+    # plays a number of random moves from the starting position so searches can be benchmarked
+    # on positions other than the opening
+    random.seed(seed)
+    state = Board()
+    colour = "D"
+    for i in range(plies):
+        actions = state.valid_moves(colour)
+        if len(actions) == 0:
+            break
+        state.place_disk(random.choice(actions), colour)
+        colour = "L" if colour == "D" else "D"
+    return state, colour
+
+def run(iterations, searches, plies, seed, max_time=None, workers=1, rollout_depth=None, pattern_evaluator=None,
+        max_nodes=None):
+    # performs a number of searches and returns the statistics from each of them
+    results = []
+    for i in range(searches):
+        state, colour = opening_position(plies, seed + i)
+        game_tree = MCTS(iterations, colour, max_time=max_time, workers=workers, rollout_depth=rollout_depth,
+                         evaluator=pattern_evaluator, max_nodes=max_nodes)
+        move, stats = game_tree.search(state, with_stats=True)
+        results.append(stats)
+    return results
+
+def match(games, max_time, workers, seed):
+    # plays games between a search using several workers and a single worker search, both given
+    # the same time for each move, and returns the number of games won by the parallel search
+    random.seed(seed)
+    wins = 0
+    for game in range(games):
+        # the parallel search plays dark disks in every other game
+        parallel_colour = "D" if game % 2 == 0 else "L"
+        state = Board()
+        colour = "D"
+        actions = state.valid_moves(colour)
+        while len(actions) > 0:
+            search_workers = workers if colour == parallel_colour else 1
+            game_tree = MCTS(None, colour, max_time=max_time, workers=search_workers)
+            state.place_disk(game_tree.search(copy.deepcopy(state)), colour)
+            colour = "L" if colour == "D" else "D"
+            actions = state.valid_moves(colour)
+
+        state.count_disks("D")
+        state.count_disks("L")
+        if state.get_winner() == parallel_colour:
+            wins += 1
+    return wins
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the monte carlo tree search")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--searches", type=int, default=5)
+    parser.add_argument("--plies", type=int, default=10, help="random moves played before each search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--time", type=float, default=None, help="time limit for each search in seconds")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes sharing each search tree")
+    parser.add_argument("--match", type=int, default=0,
+                        help="number of games to play between the parallel and single worker searches, "
+                             "each given '--time' seconds per move")
+    parser.add_argument("--weights", default=None, help="pattern evaluator weights used to truncate rollouts")
+    parser.add_argument("--rollout-depth", type=int, default=10)
+    parser.add_argument("--max-nodes", type=int, default=None, help="size limit of each search tree")
+    parser.add_argument("--json", action="store_true", help="print statistics as json lines")
+    args = parser.parse_args()
+
+    if args.match > 0:
+        max_time = args.time or 0.5
+        wins = match(args.match, max_time, args.workers, args.seed)
+        print("{0} workers won {1}/{2} games against 1 worker at {3}s per move".format(
+            args.workers, wins, args.match, max_time))
+        sys.exit()
+
+    pattern_evaluator = None
+    if args.weights is not None:
+        import evaluator
+        pattern_evaluator = evaluator.load(args.weights)
+
+    # when a time limit is given it replaces the iteration limit
+    iterations = args.iterations if args.time is None else None
+
+    start = time.perf_counter()
+    results = run(iterations, args.searches, args.plies, args.seed, args.time, args.workers, args.rollout_depth,
+                  pattern_evaluator, args.max_nodes)
+
+    for stats in results:
+        if args.json:
+            print(json.dumps(stats.as_dict()))
+        else:
+            print(stats)
+
+    total = sum(stats.iterations for stats in results)
+    print("{0} iterations in {1:.3f}s".format(total, time.perf_counter() - start))
@@ -1,3 +1,4 @@
+import copy
 import pygame
 
 # --- constants ---
@@ -10,6 +11,9 @@ WHITE = (255, 255, 255)
 GREEN = (22, 175, 0)
 BLUE = (50, 50, 255)
 
+# font used to display analysis results, created when it is first needed
+FONT = None
+
 # --- classes ---
 class Board:
     def __init__(self):
@@ -26,6 +30,12 @@ class Board:
             "D" : 2,
             "L" : 2
         }
+
+        # list of every move played in the game and the colour that played it, stored so saved
+        # games can be replayed and analysed
+        # this is None for games saved before move histories were recorded, as their earlier moves
+        # are unknown
+        self.history = []
         
     def valid_moves(self, active_colour):
         if active_colour == "D":
@@ -125,12 +135,52 @@ class Board:
         else:
             return max(self.disk_dict, key=self.disk_dict.get)
 
+    def bitboards(self):
+        # returns the board as two 64 bit integers, one for each disk colour, where the bit at
+        # (y * 8) + x is set if that tile contains a disk of the colour
+        dark = 0
+        light = 0
+        for y in range(8):
+            for x in range(8):
+                if self.tiles[y][x].disk == "D":
+                    dark |= 1 << ((y * 8) + x)
+                elif self.tiles[y][x].disk == "L":
+                    light |= 1 << ((y * 8) + x)
+        return dark, light
+
+    def copy_position(self):
+        # copies the board without its move history, searches only need the position and copying
+        # the history would make every board copied during a search slower as the game goes on
+        memo = {}
+        if self.history is not None:
+            memo[id(self.history)] = []
+        return copy.deepcopy(self, memo)
+
     def reset_valid_moves(self):
         # removes all valid moves from the board
         for row in self.tiles:
             for tile in row:
                 tile.valid_move = False
         
+    def set_analysis(self, results):
+        # stores the win rate and number of visits of each analysed move on its tile
+        # returns the tiles whose displayed results changed so only they need to be redrawn
+        changed = []
+        for y in range(8):
+            for x in range(8):
+                tile = self.tiles[y][x]
+                analysis = results.get((x, y))
+                if analysis is not None:
+                    analysis = "{0:.0f}%".format(analysis[0] * 100), str(analysis[1])
+
+                if getattr(tile, "analysis", None) != analysis:
+                    tile.analysis = analysis
+                    changed.append(tile)
+        return changed
+
+    def clear_analysis(self):
+        return self.set_analysis({})
+
     def draw(self, screen):
         # iterates through each tile and draws it onto the screen
         for row in self.tiles:
@@ -144,6 +194,9 @@ class Tile:
         self.disk = " "
         self.valid_move = False
 
+        # the win rate and number of visits shown on the tile in analysis mode
+        self.analysis = None
+
         self.body = pygame.Rect(self.pos_x, self.pos_y, 45, 45)
 
     def check_clicked(self, mouse_pos, click):
@@ -162,8 +215,41 @@ class Tile:
         if self.valid_move == True:
             pygame.draw.rect(screen, BLUE, self.body, 3)
 
+            # in analysis mode, the move's win rate and number of visits are displayed on the tile
+            # tiles from games saved before analysis mode existed don't have the attribute
+            if getattr(self, "analysis", None) is not None:
+                for line, text in enumerate(self.analysis):
+                    text_surface = get_font().render(text, True, WHITE)
+                    text_rect = text_surface.get_rect()
+                    text_rect.center = (self.pos_x + 22, self.pos_y + 15 + (line * 14))
+                    screen.blit(text_surface, text_rect)
+
         # if tile contains a disk, a circle of the disk's colour is drawn on top of it
         if self.disk == "D":
             pygame.draw.circle(screen, BLACK, (self.pos_x + 22, self.pos_y + 22), 21)
         elif self.disk == "L":
             pygame.draw.circle(screen, WHITE, (self.pos_x + 22, self.pos_y + 22), 21)
+
+# --- functions ---
+def get_font():
+    global FONT
+    if FONT is None:
+        FONT = pygame.font.Font("freesansbold.ttf", 11)
+    return FONT
+
+def from_bitboards(dark, light):
+    # creates a board from the two integers returned by 'Board.bitboards'
+    board = Board()
+    for y in range(8):
+        for x in range(8):
+            square = 1 << ((y * 8) + x)
+            if dark & square:
+                board.tiles[y][x].disk = "D"
+            elif light & square:
+                board.tiles[y][x].disk = "L"
+            else:
+                board.tiles[y][x].disk = " "
+
+    board.count_disks("D")
+    board.count_disks("L")
+    return board
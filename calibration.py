@@ -0,0 +1,126 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+from board import Board
+from montecarlo import ENGINE_VERSION, MCTS
+
+# --- constants ---
+
+# calibration results are stored per machine in the user's cache directory
+CACHE_DIR = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+CACHE_FILE = os.path.join(CACHE_DIR, "othello", "calibration.json")
+
+# time in seconds spent measuring each of rollout and iteration speed
+BENCHMARK_TIME = 0.5
+
+# the strength of each difficulty is the number of iterations it used before calibration, which
+# is the least it uses on any machine, the latency is the time a move should take
+DIFFICULTIES = {
+    "Easy" : {"iterations" : 10, "latency" : 0.25},
+    "Normal" : {"iterations" : 100, "latency" : 1.0},
+    "Hard" : {"iterations" : 200, "latency" : 2.0}
+}
+
+# --- functions ---
+
+def machine_key(truncated):
+    # results only apply to the same machine running the same version of the engine, with or
+    # without the pattern evaluator
+    return "|".join([
+        platform.node(),
+        platform.machine(),
+        platform.processor(),
+        str(os.cpu_count()),
+        platform.python_implementation() + " " + platform.python_version(),
+        "engine " + ENGINE_VERSION,
+        "truncated" if truncated else "full"
+    ])
+
+def run_benchmark(duration=BENCHMARK_TIME, rollout_depth=None, evaluator=None):
+    # measures how many rollouts and search iterations this machine performs each second from
+    # the opening position, where rollouts are longest
+    random.seed(0)
+    game_tree = MCTS(None, "D", rollout_depth=rollout_depth, evaluator=evaluator)
+
+    rollouts = 0
+    start = time.perf_counter()
+    while (rollouts == 0) or (time.perf_counter() - start < duration):
+        game_tree.rollout(Board(), "D")
+        rollouts += 1
+    rollout_time = time.perf_counter() - start
+
+    game_tree.max_time = duration
+    move, stats = game_tree.search(Board(), with_stats=True)
+
+    return {
+        "rollouts_per_second" : rollouts / rollout_time,
+        "iterations_per_second" : stats.iterations_per_second(),
+        "time" : time.time()
+    }
+
+def load_cache(path=CACHE_FILE):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache, path=CACHE_FILE):
+    # written to a temporary file first so other processes never read a partly written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temporary, "w") as file:
+        json.dump(cache, file, indent=2)
+    os.replace(temporary, path)
+
+def calibrate(force=False, path=CACHE_FILE):
+    # returns this machine's cached results, running the benchmark if there are none
+    from player import ROLLOUT_DEPTH, get_evaluator
+
+    evaluator = get_evaluator()
+    key = machine_key(evaluator is not None)
+    cache = load_cache(path)
+    if force or key not in cache:
+        cache[key] = run_benchmark(rollout_depth=ROLLOUT_DEPTH, evaluator=evaluator)
+        save_cache(cache, path)
+    return cache[key]
+
+def cached_result(path=CACHE_FILE):
+    # returns this machine's cached results without running the benchmark, or None if it hasn't
+    # been calibrated
+    from player import get_evaluator
+
+    return load_cache(path).get(machine_key(get_evaluator() is not None))
+
+def get_budget(difficulty, result=None):
+    # returns the number of iterations for a difficulty, which is the number this machine performs
+    # within the difficulty's latency so that moves take the same time on every machine
+    # the difficulty's strength is the least it uses, so a machine too slow to reach it within the
+    # latency takes longer rather than playing weaker moves
+    # rollout speed is only reported, the iteration speed already includes the time spent on rollouts
+    target = DIFFICULTIES[difficulty]
+    if result is None:
+        result = cached_result()
+    if result is None:
+        # without calibration, the difficulty behaves as it did before calibration existed
+        return target["iterations"]
+
+    affordable = int(result["iterations_per_second"] * target["latency"])
+    return max(target["iterations"], affordable)
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure this machine's search speed and set AI budgets")
+    parser.add_argument("--force", action="store_true", help="run the benchmark even if a result is cached")
+    args = parser.parse_args()
+
+    result = calibrate(args.force)
+    print("{0:.0f} rollouts/s, {1:.0f} iterations/s".format(result["rollouts_per_second"],
+                                                           result["iterations_per_second"]))
+    for difficulty in DIFFICULTIES:
+        iterations = get_budget(difficulty, result)
+        print("{0}: {1} iterations, about {2:.2f}s".format(difficulty, iterations,
+                                                            iterations / result["iterations_per_second"]))
@@ -0,0 +1,184 @@
+import argparse
+import copy
+import random
+from math import exp
+import numpy as np
+from board import Board, from_bitboards
+
+# --- functions ---
+
+def rotate(squares):
+    # rotates a list of squares 90 degrees clockwise around the centre of the board
+    return [(7 - y, x) for x, y in squares]
+
+def rotations(squares):
+    # returns the pattern in all four orientations, each orientation shares the same weights
+    instances = [squares]
+    for i in range(3):
+        instances.append(rotate(instances[-1]))
+    return instances
+
+# --- constants ---
+
+# each pattern is a list of the squares it covers in every orientation
+# rotating a diagonal twice gives the same squares in reverse, so only the first two orientations
+# of the diagonals are used, otherwise each diagonal would be counted twice
+PATTERNS = [
+    rotations([(x, 0) for x in range(8)]), # edges
+    rotations([(x, y) for y in range(3) for x in range(3)]), # 3x3 corners
+    rotations([(i, i) for i in range(8)])[:2] # diagonals
+]
+
+# every arrangement of a pattern has its own weight, each square can be empty, the evaluated
+# player's colour or the opponent's colour so a pattern of n squares has 3^n weights
+# the weights of all patterns are stored in one array, followed by a single bias weight
+OFFSETS = []
+TABLE_SIZE = 0
+for pattern in PATTERNS:
+    OFFSETS.append(TABLE_SIZE)
+    TABLE_SIZE += 3 ** len(pattern[0])
+BIAS = TABLE_SIZE
+
+# value of each square when finding the index of a pattern's arrangement
+SQUARE_VALUES = {
+    "D" : {" " : 0, "D" : 1, "L" : 2},
+    "L" : {" " : 0, "L" : 1, "D" : 2}
+}
+
+# --- classes ---
+class PatternEvaluator:
+    def __init__(self, weights, path=None):
+        self.weights = weights
+
+        # the file the weights were loaded from, so that worker processes can map the file
+        # themselves instead of being sent a copy of the weights
+        self.path = path
+
+    def features(self, state, colour):
+        # returns the index of the weight for each pattern instance on the board, and the bias
+        values = SQUARE_VALUES[colour]
+        tiles = state.tiles
+        indices = [BIAS]
+
+        for offset, pattern in zip(OFFSETS, PATTERNS):
+            for instance in pattern:
+                index = 0
+                for x, y in instance:
+                    index = (index * 3) + values[tiles[y][x].disk]
+                indices.append(offset + index)
+        return indices
+
+    def evaluate(self, state, colour):
+        # returns the evaluation of the position for the passed colour, positive values favour the colour
+        return float(self.weights[self.features(state, colour)].sum())
+
+    def win_probability(self, state, colour):
+        return sigmoid(self.evaluate(state, colour))
+
+    def __getstate__(self):
+        if self.path is not None:
+            return {"weights" : None, "path" : self.path}
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.weights is None:
+            self.weights = np.load(self.path, mmap_mode="r")
+
+# --- functions ---
+
+def sigmoid(value):
+    # limits the value so that very large evaluations don't overflow
+    value = max(min(value, 30.0), -30.0)
+    return 1 / (1 + exp(-value))
+
+def load(path):
+    # the weights are memory mapped rather than read, so loading is instant and the pages are
+    # shared between every process using the same file
+    return PatternEvaluator(np.load(path, mmap_mode="r"), path)
+
+def save(weights, path):
+    np.save(path, np.asarray(weights, dtype=np.float32))
+
+def play_game(iterations):
+    # plays a game against itself and returns every position with the colour to move and the
+    # final result for that colour, 1 for a win, 0 for a loss and 0.5 for a draw
+    from montecarlo import MCTS
+
+    state = Board()
+    colour = "D"
+    positions = []
+    actions = state.valid_moves(colour)
+
+    while len(actions) > 0:
+        positions.append((state.bitboards(), colour))
+        if iterations > 0:
+            move = MCTS(iterations, colour).search(copy.deepcopy(state))
+        else:
+            move = random.choice(actions)
+        state.place_disk(move, colour)
+        colour = "L" if colour == "D" else "D"
+        actions = state.valid_moves(colour)
+
+    state.count_disks("D")
+    state.count_disks("L")
+    winner = state.get_winner()
+
+    for bitboards, colour in positions:
+        if winner is None:
+            yield bitboards, colour, 0.5
+        else:
+            yield bitboards, colour, float(winner == colour)
+
+def train(batches, epochs=3, learning_rate=0.01):
+    # fits the weights to the results of the passed positions with logistic regression
+    # 'batches' is called at the start of each epoch and returns batches of samples, so only one
+    # batch of positions is held in memory at a time
+    # each sample is a pair of bitboards, the colour to move and the result for that colour
+    evaluator = PatternEvaluator(np.zeros(TABLE_SIZE + 1, dtype=np.float32))
+
+    for epoch in range(epochs):
+        for batch in batches():
+            batch = list(batch)
+            random.shuffle(batch)
+            for bitboards, colour, result in batch:
+                indices = np.array(evaluator.features(from_bitboards(*bitboards), colour))
+                error = sigmoid(float(evaluator.weights[indices].sum())) - result
+
+                # the same weight can appear twice in one position, so the updates are accumulated
+                np.subtract.at(evaluator.weights, indices, learning_rate * error)
+
+    return evaluator.weights
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the pattern evaluator from self-play games")
+    parser.add_argument("-o", "--output", default="weights.npy")
+    parser.add_argument("--store", default=None, help="train from a self-play position store instead of new games")
+    parser.add_argument("--games", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=0,
+                        help="search iterations for each self-play move, 0 plays random moves")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    if args.store is not None:
+        # positions are read from the store's memory map one batch at a time
+        from selfplay import PositionStore, training_batches
+        store = PositionStore(args.store)
+        batches = lambda: training_batches(store)
+        positions = len(store)
+        games = store.games()
+    else:
+        samples = []
+        for game in range(args.games):
+            samples.extend(play_game(args.iterations))
+        batches = lambda: [samples]
+        positions = len(samples)
+        games = args.games
+
+    weights = train(batches, args.epochs, args.learning_rate)
+    save(weights, args.output)
+    print("Trained on {0} positions from {1} games".format(positions, games))
@@ -1,11 +1,15 @@
+import argparse
+import calibration
 import easygui
 import pickle
 import pygame
 import random
 import sys
 import threading
+import time
 from elements import Element, Text, Button
 from board import Board
+from montecarlo import MCTS
 from player import Player, AI
 
 # --- constants ---
@@ -14,8 +18,15 @@ SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 395
 SCREEN_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT)
 
+# maximum number of times the screen is redrawn each second, 0 removes the limit
 FPS = 60
 
+# longest time in milliseconds the program waits for an event when the screen doesn't need redrawing
+IDLE_TIMEOUT = 500
+
+# minimum time in seconds between AI progress events, so the search isn't slowed by redrawing
+AI_PROGRESS_INTERVAL = 0.25
+
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (200, 35, 0)
@@ -30,6 +41,26 @@ AI_TURN = pygame.event.Event(GETAIMOVE)
 PLACEDISK = pygame.USEREVENT + 2
 MOVE_CHOSEN = pygame.event.Event(PLACEDISK)
 
+# creating custom event for when an AI player's search has progressed
+AIPROGRESS = pygame.USEREVENT + 3
+
+# creating custom event for when the analysis search has new results
+ANALYSISUPDATE = pygame.USEREVENT + 4
+
+# minimum time in seconds between analysis results being displayed
+ANALYSIS_INTERVAL = 0.25
+
+# number of iterations between checks of whether results should be displayed
+ANALYSIS_CALLBACK_INTERVAL = 10
+
+# limits on the analysis search, so it doesn't run forever or use too much memory while a player thinks
+ANALYSIS_ITERATIONS = 20000
+ANALYSIS_MAX_NODES = 20000
+
+# events which never change what is displayed, so they don't cause the screen to be redrawn
+# analysis results only redraw the tiles which changed
+IDLE_EVENTS = [pygame.NOEVENT, pygame.MOUSEMOTION, pygame.MOUSEBUTTONUP, ANALYSISUPDATE]
+
 # --- classes ---
 
 # - state classes -
@@ -42,6 +73,10 @@ class States(object):
         self.quit = False
         self.previous = None
 
+        # areas of the screen which have been drawn on since the last frame, used when only part of
+        # the screen needs updating
+        self.dirty_rects = []
+
     def check_buttons(self, mouse_pos, click):
         # checks each button object to find the one that was clicked
         for element in Element._registry:
@@ -269,22 +304,50 @@ class Game(States):
         self.txt_turn = Text(495, 200, "Turn", 30)
         self.txt_playernum = Text(495, 230, "", 20)
         self.txt_message = Text(495, 270, "Place a Dark Disk", 20)
+        self.txt_debug = Text(495, 388, "", 10)
 
         self.players = []
         self.conceded = False
         self.move = None
+
+        # statistics of the AI search in progress, sent by AI progress events
+        self.progress_stats = None
+        self.progress_time = 0
+
+        # when analysis mode is on, the engine's evaluation of each move is shown to human players
+        self.analysis = LiveAnalysis()
+        self.analysis_mode = False
         
     def cleanup(self):
+        self.analysis.stop()
+        self.b.clear_analysis()
         print("Game Ended")
 
     def startup(self):
         # finds the initial valid moves
         self.actions = self.b.valid_moves(self.players[self.active_player].colour)
         self.conceded = False
+
+        # games saved before move histories were recorded don't know their earlier moves, so
+        # their history is marked as incomplete
+        if not hasattr(self.b, "history"):
+            self.b.history = None
         
         if isinstance(self.players[self.active_player], AI):
             pygame.event.post(AI_TURN)
 
+        self.update_analysis()
+
+    def update_analysis(self):
+        # stops analysing the previous position and starts analysing the current one if the
+        # active player is a Human
+        self.analysis.stop()
+        self.b.clear_analysis()
+
+        if self.analysis_mode and self.actions and not self.conceded:
+            if not isinstance(self.players[self.active_player], AI):
+                self.analysis.start(self.b, self.players[self.active_player].colour)
+
     def get_event(self, event):
         # these are events unique to the 'game' state
 
@@ -314,10 +377,32 @@ class Game(States):
             else:
                 self.check_buttons(mouse_pos, click)
 
+        # pressing 'A' turns analysis mode on or off
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_a:
+                self.analysis_mode = not self.analysis_mode
+                self.update_analysis()
+
+        # this happens whenever an AI search posts its progress
+        elif event.type == AIPROGRESS:
+            self.progress_stats = event.stats
+
+        # this happens whenever the analysis search has new results
+        elif event.type == ANALYSISUPDATE:
+            # results from the search of a previous position are ignored
+            if event.generation == self.analysis.generation:
+                # only the tiles whose results changed are redrawn
+                for tile in self.b.set_analysis(event.results):
+                    tile.draw(app.screen)
+                    self.dirty_rects.append(tile.body)
+
         # this happens whenever the 'MOVE_CHOSEN' event is posted
         elif event.type == PLACEDISK:
+            self.progress_stats = None
             # places a disk in the position the active player chose
             self.b.place_disk(self.move, self.players[self.active_player].colour)
+            if self.b.history is not None:
+                self.b.history.append((self.move, self.players[self.active_player].colour))
 
             # changes the active player and finds their valid moves
             self.active_player = int(not bool(self.active_player))
@@ -328,11 +413,26 @@ class Game(States):
                 if self.actions and not self.conceded:
                     pygame.event.post(AI_TURN)
 
+            self.update_analysis()
+
     def get_ai_move(self):
         # passes board object to player object so AI can determine its best move
-        self.move = self.players[self.active_player].get_move(self.b)
+        # the search only reports its progress when it is displayed by the debug overlay
+        callback = None
+        if app.debug:
+            self.progress_time = 0
+            callback = self.post_ai_progress
+
+        self.move = self.players[self.active_player].get_move(self.b, callback)
         pygame.event.post(MOVE_CHOSEN)
 
+    def post_ai_progress(self, stats):
+        # called from the AI thread during its search, events are posted at a limited rate
+        now = time.perf_counter()
+        if now - self.progress_time >= AI_PROGRESS_INTERVAL:
+            self.progress_time = now
+            pygame.event.post(pygame.event.Event(AIPROGRESS, stats=stats))
+
     def save(self):
         try:
             # prompts user to choose a directory to save their file
@@ -353,6 +453,7 @@ class Game(States):
         
     def concede(self):
         self.conceded = True
+        self.update_analysis()
 
     def update(self, screen):
         # this performs the same purpose as the update subroutine in the 'menu' state
@@ -416,15 +517,94 @@ class Game(States):
         self.txt_turn.show(screen)
         self.txt_playernum.show(screen)
         self.txt_message.show(screen)
+
+        # when debugging is enabled, statistics from the last AI search are displayed
+        if app.debug:
+            self.show_debug(screen)
                 
         self.b.draw(screen)
 
+    def show_debug(self, screen):
+        # finds the most recent search statistics from either AI player, or the statistics of the
+        # search currently in progress
+        stats = self.progress_stats
+        if stats is None:
+            for player in self.players:
+                if isinstance(player, AI) and getattr(player, "stats", None) is not None:
+                    stats = player.stats
+
+        if stats is not None:
+            self.txt_debug.text = "{0:.0f} it/s, {1} nodes, depth {2}".format(
+                stats.iterations_per_second(), stats.nodes, stats.max_depth)
+            self.txt_debug.show(screen)
+
+# - analysis class -
+
+# searches the current position in a background thread and posts the results of each move as
+# events, so that the search never slows down the thread drawing the screen
+class LiveAnalysis:
+    def __init__(self):
+        self.game_tree = None
+        self.thread = None
+
+        # increased for each new search so that results from an old position can be ignored
+        self.generation = 0
+        self.post_time = 0
+
+    def start(self, state, colour):
+        self.stop()
+        self.generation += 1
+        self.post_time = 0
+
+        self.game_tree = MCTS(ANALYSIS_ITERATIONS, colour, callback=self.post_progress,
+                              callback_interval=ANALYSIS_CALLBACK_INTERVAL, max_nodes=ANALYSIS_MAX_NODES)
+        self.thread = threading.Thread(target=self.search, args=(self.game_tree, state.copy_position(),
+                                       self.generation), daemon=True)
+        self.thread.start()
+
+    def search(self, game_tree, state, generation):
+        game_tree.search(state)
+
+        # the final results are always displayed
+        self.post_results(game_tree, generation)
+
+    def post_progress(self, stats):
+        # called from the analysis thread during its search, results are posted at a limited rate
+        now = time.perf_counter()
+        if now - self.post_time >= ANALYSIS_INTERVAL:
+            self.post_time = now
+            self.post_results(self.game_tree, self.generation)
+
+    def post_results(self, game_tree, generation):
+        # the win rate and number of visits of each move from the root
+        results = {}
+        for action, child in list(game_tree.root.children.items()):
+            if child.n > 0:
+                results[action] = (child.w / child.n, child.n)
+
+        pygame.event.post(pygame.event.Event(ANALYSISUPDATE, results=results, generation=generation))
+
+    def stop(self):
+        # ends the current search and waits for its thread to finish
+        if self.game_tree is not None:
+            self.game_tree.stop()
+            self.thread.join()
+            self.game_tree = None
+            self.thread = None
+
+            # the stopped search still posts its final results, which are ignored as they are for
+            # a position that is no longer being analysed
+            self.generation += 1
+
 # - application class -
 class Application:
     def __init__(self, state_dict, **settings):
         self.__dict__.update(settings)
         self.done = False
 
+        # set when the screen needs to be redrawn
+        self.dirty = True
+
         self.btn_quit = Button(225, 330, 150, 40, RED, "Quit", self.quit)
         self.btn_return = Button(415, 340, 170, 40, GREEN, "Return to Menu", self.flip_state)
 
@@ -467,8 +647,16 @@ class Application:
 
     def event_loop(self):
         # gets all inputs that have occured since last frame
+        # if nothing needs redrawing, the program sleeps until an event arrives instead of polling
+        if self.dirty:
+            events = pygame.event.get()
+        else:
+            events = [pygame.event.wait(self.idle_timeout)] + pygame.event.get()
+
         # all inputs are within the class of the active state except quitting
-        for event in pygame.event.get():
+        for event in events:
+            if event.type not in IDLE_EVENTS:
+                self.dirty = True
             if event.type == pygame.QUIT:
                 self.quit()
             self.state.get_event(event)
@@ -477,13 +665,24 @@ class Application:
         # this will be looped repeatedly until user quits
         while not self.done:
             self.event_loop()
-            self.update()
 
-            # update game screen
-            pygame.display.update()
+            # the screen is only redrawn when an event may have changed it
+            if self.dirty:
+                self.dirty = False
+                self.state.dirty_rects = []
+                self.update()
+
+                # update game screen
+                pygame.display.update()
 
-            #
-            self.clock.tick(self.fps)
+                # limits how often the screen can be redrawn
+                self.clock.tick(self.fps)
+
+            elif self.state.dirty_rects:
+                # only the areas the state drew on are updated
+                pygame.display.update(self.state.dirty_rects)
+                self.state.dirty_rects = []
+                self.clock.tick(self.fps)
 
     def quit(self):
         self.done = True
@@ -491,9 +690,23 @@ class Application:
 # --- main ---
 if __name__ == "__main__":
     
+    parser = argparse.ArgumentParser(description="Othello")
+    parser.add_argument("--fps", type=int, default=FPS, help="maximum frames per second, 0 for no limit")
+    parser.add_argument("--debug", action="store_true", help="display AI search statistics")
+    parser.add_argument("--analysis", action="store_true",
+                        help="start with analysis mode on, it can also be turned on or off by pressing 'A'")
+    parser.add_argument("--calibrate", action="store_true", help="measure this machine's search speed again")
+    args = parser.parse_args()
+
+    # measures this machine's search speed the first time the game is run, so that AI difficulties
+    # take a consistent amount of time on every machine
+    calibration.calibrate(args.calibrate)
+
     settings = {
         "size" : SCREEN_SIZE,
-        "fps"  : FPS
+        "fps"  : args.fps,
+        "idle_timeout" : IDLE_TIMEOUT,
+        "debug" : args.debug
     }
 
     # dictionary containing names of possible states and their corresponding class                  
@@ -502,6 +715,8 @@ if __name__ == "__main__":
         "game" : Game()
     }
 
+    state_dict["game"].analysis_mode = args.analysis
+
     # declares application object and starts game
     app = Application(state_dict, **settings)
     app.main_loop()
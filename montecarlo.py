@@ -1,64 +1,241 @@
 import copy
 import random
+import sys
 import time
-from math import log, sqrt
+from math import exp, log, sqrt
+from board import DIRECTIONS
 
 # --- constants ---
 
+# changed whenever the cost of a search changes, so machines are calibrated again
+ENGINE_VERSION = "2"
+
 # exploration constant for ucb formula when selecting nodes
 C = sqrt(2)
 
+# names of the four stages of each search iteration, used as keys for the search statistics
+STAGES = ["select", "expand", "rollout", "backpropagate"]
+
+# when the tree grows past its node limit, subtrees are pruned until it is this fraction of the limit
+PRUNE_TARGET = 0.75
+
+# static value of each square, corners can never be flipped so they are the strongest squares and
+# the squares next to them are the weakest as they give the opponent access to the corner
+SQUARE_WEIGHTS = [
+    [100, -20, 10,  5,  5, 10, -20, 100],
+    [-20, -50, -2, -2, -2, -2, -50, -20],
+    [ 10,  -2,  1,  1,  1,  1,  -2,  10],
+    [  5,  -2,  1,  0,  0,  1,  -2,   5],
+    [  5,  -2,  1,  0,  0,  1,  -2,   5],
+    [ 10,  -2,  1,  1,  1,  1,  -2,  10],
+    [-20, -50, -2, -2, -2, -2, -50, -20],
+    [100, -20, 10,  5,  5, 10, -20, 100]
+]
+
+# each empty square next to a move lowers its value by this much, since placing a disk beside
+# empty squares tends to give the opponent more valid moves
+MOBILITY_WEIGHT = 4
+
+# higher temperatures make the priors of good and bad moves more even
+PRIOR_TEMPERATURE = 20
+
+# weight of a node's prior in its score, relative to the exploration constant
+PRIOR_WEIGHT = 1.0
+
+# the squares adjacent to each square, found once so they don't have to be checked against the
+# edge of the board every time
+NEIGHBOURS = [[[(x + direction[0], y + direction[1]) for direction in DIRECTIONS
+                if (0 <= x + direction[0] < 8) and (0 <= y + direction[1] < 8)]
+               for x in range(8)] for y in range(8)]
+
 # --- classes ---
 class MCTS:
-    def __init__(self, max_iterations, ai_colour):
+    def __init__(self, max_iterations, ai_colour, max_time=None, callback=None, callback_interval=100,
+                 workers=1, rollout_depth=None, evaluator=None, max_nodes=None, max_bytes=None):
         self.max_iterations = max_iterations
         self.ai_colour = ai_colour
 
-    def search(self, state):
+        # optional time limit for each search in seconds, if 'max_iterations' is None then only
+        # the time limit is used
+        self.max_time = max_time
+
+        # optional function which is passed the search statistics every 'callback_interval' iterations
+        self.callback = callback
+        self.callback_interval = callback_interval
+
+        # number of processes which search a single shared tree, one worker searches in this process
+        self.workers = workers
+
+        # if an evaluator is given, rollouts stop after 'rollout_depth' moves and the evaluator
+        # scores the position they reached
+        self.rollout_depth = rollout_depth
+        self.evaluator = evaluator
+
+        # optional limits on the size of the tree, either in nodes or in estimated bytes of memory
+        # when the tree is larger than the limit, its least visited subtrees are pruned
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+
+        # the node limit of the current search, found from both limits when each search starts
+        self.node_limit = max_nodes
+
+        # set by another thread to end the search early
+        self.stopped = False
+
+        self.stats = SearchStats()
+
+    def search(self, state, with_stats=False):
+        # statistics are reset at the start of each search
+        self.stats = SearchStats()
+
+        # a memory limit is turned into a node limit using the estimated size of a node, which
+        # depends on the board being searched
+        self.node_limit = self.max_nodes
+        if self.max_bytes is not None:
+            node_limit = self.max_bytes // estimate_node_bytes(state)
+            if self.max_nodes is not None:
+                node_limit = min(node_limit, self.max_nodes)
+            self.node_limit = max(node_limit, 1)
+
+        if self.workers > 1:
+            # the shared tree search is imported here as it depends on this module
+            from parallel import parallel_search
+            best_action = parallel_search(self, state)
+            if with_stats:
+                return best_action, self.stats
+            return best_action
+
+        start = time.perf_counter()
+
         # creates the root node as the current game state
         self.root = Node(state, self.ai_colour)
+        self.stats.nodes = 1
+        self.stats.allocations = 1
 
-        # performs iterations of the monte carlo tree search until maximum is reached
-        for i in range(self.max_iterations):
+        # performs iterations of the monte carlo tree search until maximum is reached or the
+        # time limit runs out
+        while not self.search_over():
 
             # performs the three stages of the monte carlo tree search: selection, rollout and
-            # backpropagation
+            # backpropagation, timing each one
+            expand_time = self.stats.times["expand"]
+            stage_start = time.perf_counter()
             node = self.select(self.root)
-            win = self.rollout(copy.deepcopy(node.state), node.colour)
+            stage_end = time.perf_counter()
+
+            # time spent expanding is recorded separately so it is taken off the selection time
+            self.stats.record("select", stage_end - stage_start - (self.stats.times["expand"] - expand_time))
+
+            stage_start = stage_end
+            self.stats.allocations += 1
+            win = self.rollout(node.copy_state(), node.colour)
+            stage_end = time.perf_counter()
+            self.stats.record("rollout", stage_end - stage_start)
+
+            stage_start = stage_end
             self.backpropagate(node, win)
+            self.stats.record("backpropagate", time.perf_counter() - stage_start)
+
+            if (self.node_limit is not None) and (self.stats.nodes > self.node_limit):
+                self.prune()
+
+            self.stats.iterations += 1
+            self.stats.elapsed = time.perf_counter() - start
+
+            if (self.callback is not None) and (self.stats.iterations % self.callback_interval == 0):
+                self.callback(self.stats)
+
+        self.stats.elapsed = time.perf_counter() - start
 
         # after all iterations are complete, the best child of the root node is chosen
         best_child = self.root.get_best_child(0)
+        best_action = None
         for action, child in self.root.children.items():
             if child == best_child:
-                return action
+                best_action = action
+                break
+
+        # the statistics can optionally be returned alongside the chosen move
+        if with_stats:
+            return best_action, self.stats
+        return best_action
+
+    def stop(self):
+        self.stopped = True
+
+    def search_over(self):
+        if self.stopped:
+            return True
+
+        # at least one iteration is always performed so that the root node has a child to choose
+        if self.stats.iterations == 0:
+            return False
+        if (self.max_iterations is not None) and (self.stats.iterations >= self.max_iterations):
+            return True
+        if (self.max_time is not None) and (self.stats.elapsed >= self.max_time):
+            return True
+        return False
 
     def select(self, node):
+        depth = 0
+
         # if a node isn't terminal then its children are evaluated
-        while not node.is_terminal:
+        while not self.is_terminal(node):
             # the program expands one child node at a time until all have been expanded
             # then it chooses the best child
             if node.is_fully_expanded:
                 node = node.get_best_child(C)
+                depth += 1
             else:
-                return self.expand(node)
+                node = self.expand(node)
+                depth += 1
+                break
+
+        self.stats.max_depth = max(self.stats.max_depth, depth)
         return node
 
+    def is_terminal(self, node):
+        # a node's board is copied the first time its moves are needed
+        if node.state is None:
+            self.stats.allocations += 1
+        return node.is_terminal
+
     def expand(self, node):
         # expands a single child node from the passed node
-        return node.get_child()
+        # each expansion creates a new node object, its board is only copied if it is expanded
+        start = time.perf_counter()
+        child = node.get_child()
+        self.stats.record("expand", time.perf_counter() - start)
+
+        self.stats.nodes += 1
+        self.stats.allocations += 1
+        return child
     
-    def rollout(self, state, colour):
+    def rollout(self, state, colour, depth=0):
+        if (self.evaluator is not None) and (self.rollout_depth is not None) and (depth >= self.rollout_depth):
+            # the rollout is stopped early and the evaluator's estimate of winning is used instead
+            # of the result of a finished game
+            # the evaluator was trained on positions scored for the colour to move, so the position is
+            # evaluated for that colour and turned around if it is the opponent of the AI
+            probability = self.evaluator.win_probability(state, colour)
+            if colour == self.ai_colour:
+                return probability
+            return 1 - probability
+
         # finds all valid moves for current node's game state
         actions = state.valid_moves(colour)
         
         if len(actions) == 0:
             # this is the base case of the recursive function
             # when there are no possible moves left, the winner of the simulated game is determined
+            # the disks are counted first since the board only updates its counts when they are displayed
+            state.count_disks("D")
+            state.count_disks("L")
             return state.get_winner() == self.ai_colour
         else:
             # performs a random possible move
             state.place_disk(random.choice(actions), colour)
+            self.stats.rollout_plies += 1
 
             # flips colour to simulate next player's turn
             if colour == "D":
@@ -67,28 +244,122 @@ class MCTS:
                 colour = "D"
 
             # rollout function will recursively loop until a terminal node is reached
-            return self.rollout(state, colour)
+            return self.rollout(state, colour, depth + 1)
+
+    def prune(self):
+        # collapses the least visited subtrees back into leaves until the tree is small enough
+        # the collapsed nodes keep their statistics so the search can carry on choosing between them
+        candidates = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            for child in node.children.values():
+                if child.children:
+                    candidates.append(child)
+                    stack.append(child)
+
+        target = int(self.node_limit * PRUNE_TARGET)
+        candidates.sort(key=lambda node: node.n)
+        for node in candidates:
+            if self.stats.nodes <= target:
+                break
+
+            # nodes inside a subtree which has already been collapsed are no longer in the tree
+            if not node.pruned:
+                removed = node.collapse()
+                self.stats.nodes -= removed
+                self.stats.pruned += removed
 
     def backpropagate(self, node, win):
         # program goes back up through all nodes to the root node, updating the number of times they
         # were visited and the number of times a win is reached from that node
+        # a truncated rollout counts as a fraction of a win
         while node is not None:
             node.n += 1
-            node.w += int(win)
+            node.w += win
             node = node.parent
 
+class SearchStats:
+    def __init__(self):
+        self.iterations = 0 # number of completed iterations
+        self.elapsed = 0.0 # total time spent searching in seconds
+        self.nodes = 0 # number of nodes in the search tree
+        self.max_depth = 0 # deepest node reached by the selection stage
+        self.rollout_plies = 0 # total number of moves played across all rollouts
+        self.allocations = 0 # number of board copies and node objects created, None if not measured
+        self.pruned = 0 # number of nodes removed to keep the tree within its size limit
+
+        # time spent in each stage in seconds, and the number of times each stage was performed
+        # a parallel search can't time the stages of its workers, so these are None for it
+        self.times = {stage: 0.0 for stage in STAGES}
+        self.counts = {stage: 0 for stage in STAGES}
+
+    def record(self, stage, duration):
+        # adds a single timed call of a stage to the statistics
+        self.times[stage] += duration
+        self.counts[stage] += 1
+
+    def iterations_per_second(self):
+        if self.elapsed == 0:
+            return 0.0
+        return self.iterations / self.elapsed
+
+    def average_rollout_length(self):
+        if self.counts["rollout"] == 0:
+            return 0.0
+        return self.rollout_plies / self.counts["rollout"]
+
+    def allocations_per_iteration(self):
+        if self.allocations is None:
+            return None
+        if self.iterations == 0:
+            return 0.0
+        return self.allocations / self.iterations
+
+    def as_dict(self):
+        # returns the statistics as a dictionary so they can be logged or saved as json
+        return {
+            "iterations" : self.iterations,
+            "elapsed" : self.elapsed,
+            "iterations_per_second" : self.iterations_per_second(),
+            "nodes" : self.nodes,
+            "max_depth" : self.max_depth,
+            "average_rollout_length" : self.average_rollout_length(),
+            "allocations_per_iteration" : self.allocations_per_iteration(),
+            "pruned" : self.pruned,
+            "times" : dict(self.times),
+            "counts" : dict(self.counts)
+        }
+
+    def __str__(self):
+        text = "{0} iterations in {1:.3f}s ({2:.0f}/s), {3} nodes, depth {4}, rollout length {5:.1f}".format(
+            self.iterations, self.elapsed, self.iterations_per_second(), self.nodes, self.max_depth,
+            self.average_rollout_length())
+
+        # statistics which weren't measured are left out
+        if self.allocations is not None:
+            text += ", {0:.1f} allocations/iteration".format(self.allocations_per_iteration())
+        stages = ", ".join("{0} {1:.3f}s".format(stage, self.times[stage]) for stage in STAGES
+                           if self.times[stage] is not None)
+        if stages:
+            text += " [{0}]".format(stages)
+        return text
+
 class Node:
-    def __init__(self, state, colour, parent=None):
+    def __init__(self, state, colour, parent=None, action=None, prior=1.0):
         self.colour = colour # the colour of the next disk to be placed
-        self.state = state # the current game state
-        self.actions = self.state.valid_moves(self.colour)
 
-        if len(self.actions) == 0:
-            self.is_terminal = True
-        else:
-            self.is_terminal = False
-            
-        self.is_fully_expanded = self.is_terminal
+        # the current game state, child nodes only create theirs when they are expanded since
+        # until then it can be made from the parent's state and the action leading to the node
+        self.state = state
+        self.action = action
+
+        # valid moves are only found the first time they are needed, as most nodes are only
+        # visited once by a rollout and never expanded
+        self.actions = None
+
+        # stack of valid moves which haven't been expanded yet
+        self.untried = None
         
         self.parent = parent # stores the reference of the parent node
         self.n = 0 # number of times node has been visited
@@ -97,6 +368,46 @@ class Node:
         # dictionary of child nodes, the action leading to the child node is the key
         # and the child node object is the value
         self.children = {}
+
+        # set when the node is removed from the tree by pruning
+        self.pruned = False
+
+        # the estimated probability that the action leading to the node is the best one, and the
+        # priors of the node's own valid moves once they have been found
+        self.prior = prior
+        self.priors = None
+
+    def get_state(self):
+        if self.state is None:
+            self.state = self.copy_state()
+        return self.state
+
+    def copy_state(self):
+        # returns a copy of the node's game state which can be changed without affecting the tree
+        if self.state is not None:
+            return copy.deepcopy(self.state)
+
+        state = copy.deepcopy(self.parent.get_state())
+        state.place_disk(self.action, self.parent.colour)
+        return state
+
+    def find_actions(self):
+        if self.actions is None:
+            self.actions = self.get_state().valid_moves(self.colour)
+            self.priors = get_priors(self.state, self.actions)
+
+            # the stack is sorted so that the move with the greatest prior is expanded first
+            self.untried = sorted(self.actions, key=self.priors.get)
+        return self.actions
+
+    @property
+    def is_terminal(self):
+        return len(self.find_actions()) == 0
+
+    @property
+    def is_fully_expanded(self):
+        self.find_actions()
+        return len(self.untried) == 0
         
     def get_child(self):
         if self.colour == "D":
@@ -104,19 +415,31 @@ class Node:
         elif self.colour == "L":
             child_colour = "D"
 
-        # checks each possible valid move from this node and creates a node for one that
-        # hasn't already been expanded
-        for action in self.actions:
-            if action not in self.children.keys():
-                
-                # creates a copy of the board object
-                child_state = copy.deepcopy(self.state)
-                
-                child_state.place_disk(action, self.colour)
-                self.children[action] = Node(child_state, child_colour, self)
-                if len(self.actions) == len(self.children):
-                    self.is_fully_expanded = True
-                return self.children[action]
+        # takes the next valid move which hasn't been expanded and creates a node for it
+        self.find_actions()
+        action = self.untried.pop()
+        self.children[action] = Node(None, child_colour, self, action, self.priors[action])
+        return self.children[action]
+
+    def collapse(self):
+        # removes every descendant of the node and returns how many were removed
+        removed = 0
+        stack = list(self.children.values())
+        while stack:
+            node = stack.pop()
+            node.pruned = True
+            removed += 1
+            stack.extend(node.children.values())
+
+        # the node becomes an unexpanded leaf, its board is also released as it can be made
+        # again from its parent's
+        self.children = {}
+        self.actions = None
+        self.untried = None
+        self.priors = None
+        if self.parent is not None:
+            self.state = None
+        return removed
 
     def get_best_child(self, exploration_constant):
         # finds and returns the child node with the greatest UCB value
@@ -134,11 +457,46 @@ class Node:
 
     def get_score(self, exploration_constant):
         # uses the Upper Confidence Bound formula to determine a node's score
+        # a PUCT style prior term is added, which favours plausible moves while the node has few visits
         try:
             win_ratio = self.w / self.n
             ucb = win_ratio + (exploration_constant * sqrt(log(self.parent.n) / self.n))
+            ucb += exploration_constant * PRIOR_WEIGHT * self.prior * sqrt(self.parent.n) / (1 + self.n)
             self.score = ucb
         except ZeroDivisionError:
             # if value from UCB formula is infinity, then an error must be caught and
             # the score is returned as a float
             self.score = float("inf")
+
+# --- functions ---
+def get_priors(state, actions):
+    # gives each valid move a probability from the static value of its square and the number of
+    # empty squares around it
+    scores = []
+    for x, y in actions:
+        empty = 0
+        for neighbour_x, neighbour_y in NEIGHBOURS[y][x]:
+            if state.tiles[neighbour_y][neighbour_x].disk == " ":
+                empty += 1
+        scores.append(SQUARE_WEIGHTS[y][x] - (MOBILITY_WEIGHT * empty))
+
+    # the scores are turned into probabilities with the softmax function, the greatest score is
+    # taken away first so the exponentials can't overflow
+    if len(scores) == 0:
+        return {}
+    greatest = max(scores)
+    weights = [exp((score - greatest) / PRIOR_TEMPERATURE) for score in scores]
+    total = sum(weights)
+    return {action: weight / total for action, weight in zip(actions, weights)}
+
+def estimate_node_bytes(state):
+    # estimates the memory used by a node with its own copy of the board
+    size = sys.getsizeof(state) + sys.getsizeof(state.__dict__) + sys.getsizeof(state.tiles)
+    for row in state.tiles:
+        size += sys.getsizeof(row)
+        for tile in row:
+            size += sys.getsizeof(tile) + sys.getsizeof(tile.__dict__) + sys.getsizeof(tile.body)
+
+    node = Node(None, "D")
+    size += sys.getsizeof(node) + sys.getsizeof(node.__dict__) + sys.getsizeof(node.children)
+    return size
@@ -0,0 +1,284 @@
+import copy
+import ctypes
+import multiprocessing
+import random
+import time
+from math import log, sqrt
+from montecarlo import C, PRIOR_WEIGHT, STAGES, MCTS, get_priors
+
+# --- constants ---
+
+# number of locks shared between the nodes of the tree, each node uses the lock at its index
+# modulo this number
+LOCK_STRIPES = 64
+
+# number of losses temporarily added to a node while a worker is searching below it, this makes
+# other workers less likely to choose the same path
+VIRTUAL_LOSS = 1
+
+# maximum number of nodes in the tree when the search only has a time limit
+DEFAULT_CAPACITY = 50000
+
+# time in seconds between checks of the shared tree while the workers search, to pass the search
+# statistics to the callback and to tell the workers when the search has been stopped
+POLL_INTERVAL = 0.05
+
+# --- classes ---
+
+# a search tree held in shared memory arrays so several processes can search it at once
+# each node is an index into the arrays, with the root at index 0
+class SharedTree:
+    def __init__(self, capacity):
+        self.capacity = capacity
+
+        self.n = multiprocessing.Array("i", capacity, lock=False) # number of times node has been visited
+        self.w = multiprocessing.Array("d", capacity, lock=False) # number of wins possible from node
+        self.virtual = multiprocessing.Array("i", capacity, lock=False) # virtual losses on the node
+        self.parent = multiprocessing.Array("i", capacity, lock=False)
+        self.move = multiprocessing.Array("b", capacity, lock=False) # square of the move leading to the node
+        self.expanded = multiprocessing.Array("b", capacity, lock=False) # number of expanded children
+        self.prior = multiprocessing.Array("d", capacity, lock=False) # prior of the move leading to the node
+
+        # number of valid moves from the node, -1 until the node's moves have been found
+        self.actions = multiprocessing.Array("b", capacity, lock=False)
+
+        # index of the child for each of the 64 squares, -1 if the child hasn't been expanded
+        self.children = multiprocessing.Array("i", capacity * 64, lock=False)
+
+        # setting every byte to 0xFF sets every value in the arrays to -1
+        for array in [self.parent, self.move, self.actions, self.children]:
+            ctypes.memset(ctypes.addressof(array), 0xFF, ctypes.sizeof(array))
+
+        self.size = multiprocessing.Value("i", 1, lock=False)
+        self.max_depth = multiprocessing.Value("i", 0, lock=False)
+        self.iterations = multiprocessing.Value("i", 0, lock=False)
+        self.rollout_plies = multiprocessing.Value("i", 0, lock=False)
+
+        # set when the search is stopped early, each worker finishes its current iteration and returns
+        self.stopped = multiprocessing.Value("b", 0, lock=False)
+
+        self.locks = [multiprocessing.Lock() for i in range(LOCK_STRIPES)]
+        self.alloc_lock = multiprocessing.Lock()
+
+    def lock(self, node):
+        return self.locks[node % LOCK_STRIPES]
+
+    def claim_iteration(self, max_iterations):
+        # workers take iterations from a shared counter so the total matches the maximum
+        with self.alloc_lock:
+            if self.stopped.value and (self.iterations.value > 0):
+                return False
+            if (max_iterations is not None) and (self.iterations.value >= max_iterations):
+                return False
+            self.iterations.value += 1
+            return True
+
+    def select(self, state, colour):
+        # descends the tree from the root, playing each move on the passed board
+        # returns the path of nodes visited along with the board and colour at the end of it
+        node = 0
+        path = [0]
+        self.add_virtual_loss(node)
+
+        while True:
+            if self.expanded[node] != self.actions[node]:
+                # the node's moves haven't been found yet or some of its children haven't been expanded
+                child, action = self.expand(node, state, colour, len(path))
+                if child is not None:
+                    state.place_disk(action, colour)
+                    path.append(child)
+                    return path, state, self.flip(colour)
+
+            if (self.actions[node] == 0) or (self.expanded[node] != self.actions[node]):
+                # the node is terminal, or the tree is full so the node is treated as a leaf
+                return path, state, colour
+
+            node = self.get_best_child(node)
+            self.add_virtual_loss(node)
+            state.place_disk(self.to_action(self.move[node]), colour)
+            path.append(node)
+            colour = self.flip(colour)
+
+    def expand(self, node, state, colour, depth):
+        # creates a node for a valid move that hasn't been expanded yet
+        # nothing is created if the tree is full or another worker expanded the last child first
+        actions = state.valid_moves(colour)
+        priors = get_priors(state, actions)
+        base = node * 64
+
+        with self.lock(node):
+            self.actions[node] = len(actions)
+
+            # moves with greater priors are expanded first
+            for action in sorted(actions, key=priors.get, reverse=True):
+                square = self.to_square(action)
+                if self.children[base + square] != -1:
+                    continue
+
+                with self.alloc_lock:
+                    if self.size.value >= self.capacity:
+                        break
+                    child = self.size.value
+                    self.size.value += 1
+                    self.max_depth.value = max(self.max_depth.value, depth)
+
+                self.parent[child] = node
+                self.move[child] = square
+                self.prior[child] = priors[action]
+                self.virtual[child] = VIRTUAL_LOSS
+                self.children[base + square] = child
+                self.expanded[node] += 1
+                return child, action
+
+        return None, None
+
+    def get_best_child(self, node):
+        # finds the child with the greatest UCB value with the same prior term as the single worker
+        # search, counting virtual losses as visits without wins
+        # the statistics are read without locking, so they may be slightly out of date
+        base = node * 64
+        parent_visits = self.n[node] + self.virtual[node]
+        best_child = None
+        best_score = None
+
+        for square in range(64):
+            child = self.children[base + square]
+            if child == -1:
+                continue
+
+            visits = self.n[child] + self.virtual[child]
+            if visits == 0:
+                score = float("inf")
+            else:
+                score = (self.w[child] / visits) + (C * sqrt(log(max(parent_visits, 1)) / visits))
+                score += C * PRIOR_WEIGHT * self.prior[child] * sqrt(parent_visits) / (1 + visits)
+
+            if (best_child is None) or (score > best_score):
+                best_child, best_score = child, score
+            elif (score == best_score) and (random.random() < 0.5):
+                best_child = child
+
+        return best_child
+
+    def add_virtual_loss(self, node):
+        with self.lock(node):
+            self.virtual[node] += VIRTUAL_LOSS
+
+    def backpropagate(self, path, win):
+        # updates each node on the path and removes the virtual losses added during selection
+        for node in path:
+            with self.lock(node):
+                self.n[node] += 1
+                self.w[node] += win
+                self.virtual[node] -= VIRTUAL_LOSS
+
+    def best_action(self):
+        # chooses the child of the root with the greatest win ratio
+        best_square = None
+        best_ratio = None
+        for square in range(64):
+            child = self.children[square]
+            if (child == -1) or (self.n[child] == 0):
+                continue
+
+            ratio = self.w[child] / self.n[child]
+            if (best_ratio is None) or (ratio > best_ratio):
+                best_square, best_ratio = square, ratio
+
+        if best_square is None:
+            return None
+        return self.to_action(best_square)
+
+    def flip(self, colour):
+        if colour == "D":
+            return "L"
+        return "D"
+
+    def to_square(self, action):
+        return action[1] * 8 + action[0]
+
+    def to_action(self, square):
+        return (square % 8, square // 8)
+
+# --- functions ---
+
+def search_worker(tree, state, ai_colour, max_iterations, deadline, seed, rollout_depth, evaluator):
+    # runs in each worker process, performing iterations until the shared maximum or deadline is reached
+    random.seed(seed)
+
+    # a single worker search object is only used for its rollout
+    rollouts = MCTS(None, ai_colour, rollout_depth=rollout_depth, evaluator=evaluator)
+
+    # at least one iteration is always performed so that the root node has a child to choose
+    while (deadline is None) or (time.time() < deadline) or (tree.iterations.value == 0):
+        if not tree.claim_iteration(max_iterations):
+            break
+
+        path, node_state, colour = tree.select(copy.deepcopy(state), ai_colour)
+        plies = rollouts.stats.rollout_plies
+        win = rollouts.rollout(node_state, colour)
+        tree.backpropagate(path, win)
+
+        # added after every rollout so the statistics passed to the callback are up to date
+        with tree.alloc_lock:
+            tree.rollout_plies.value += rollouts.stats.rollout_plies - plies
+
+def parallel_search(game_tree, state):
+    # performs the search of the passed 'MCTS' object using several processes that share one tree
+    start = time.perf_counter()
+
+    if game_tree.max_iterations is not None:
+        capacity = game_tree.max_iterations + 1
+    else:
+        capacity = DEFAULT_CAPACITY
+
+    # the shared tree can't be pruned while workers are searching it, so a node limit caps its
+    # size instead and nodes are treated as leaves once it is full
+    if game_tree.node_limit is not None:
+        capacity = max(min(capacity, game_tree.node_limit), 1)
+    tree = SharedTree(capacity)
+
+    deadline = None
+    if game_tree.max_time is not None:
+        deadline = time.time() + game_tree.max_time
+
+    workers = []
+    for i in range(game_tree.workers):
+        worker = multiprocessing.Process(target=search_worker, args=(tree, state, game_tree.ai_colour,
+                                         game_tree.max_iterations, deadline, random.getrandbits(32),
+                                         game_tree.rollout_depth, game_tree.evaluator))
+        worker.start()
+        workers.append(worker)
+
+    # while the workers search, this process passes the statistics to the callback every
+    # 'callback_interval' iterations and passes on any request to stop the search
+    callbacks = 0
+    while any(worker.is_alive() for worker in workers):
+        workers[0].join(POLL_INTERVAL)
+        if game_tree.stopped:
+            tree.stopped.value = 1
+
+        if (game_tree.callback is not None) and (tree.iterations.value // game_tree.callback_interval > callbacks):
+            callbacks = tree.iterations.value // game_tree.callback_interval
+            game_tree.callback(record_stats(game_tree.stats, tree, start))
+
+    for worker in workers:
+        worker.join()
+
+    record_stats(game_tree.stats, tree, start)
+    game_tree.shared_tree = tree
+    return tree.best_action()
+
+def record_stats(stats, tree, start):
+    # only the statistics which are shared between workers are recorded, the rest are left as None
+    # rather than reported as 0 since they weren't measured
+    stats.iterations = tree.iterations.value
+    stats.elapsed = time.perf_counter() - start
+    stats.nodes = tree.size.value
+    stats.max_depth = tree.max_depth.value
+    stats.rollout_plies = tree.rollout_plies.value
+    stats.allocations = None
+    stats.times = {stage: None for stage in STAGES}
+    stats.counts = {stage: None for stage in STAGES}
+    stats.counts["rollout"] = tree.iterations.value
+    return stats
@@ -1,6 +1,31 @@
-import copy
+import calibration
+import os
 from montecarlo import MCTS
 
+try:
+    import evaluator
+except ImportError:
+    # the pattern evaluator needs numpy, without it rollouts always play to the end of the game
+    evaluator = None
+
+# --- constants ---
+
+# trained pattern weights, if the file exists the AI stops its rollouts early and uses the pattern
+# evaluator to score them
+WEIGHTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights.npy")
+ROLLOUT_DEPTH = 10
+
+# --- functions ---
+
+def get_evaluator():
+    # the weights are only loaded once and shared by every AI player
+    global _evaluator
+    if _evaluator is None and evaluator is not None and os.path.exists(WEIGHTS_FILE):
+        _evaluator = evaluator.load(WEIGHTS_FILE)
+    return _evaluator
+
+_evaluator = None
+
 # --- classes ---
 class Player(object):
     def __init__(self, name):
@@ -13,18 +38,18 @@ class AI(Player):
         
         self.difficulty = difficulty
 
-        # determines how many monte carlo tree search iterations are performed
-        # based on difficulty of AI
-        if self.difficulty == "Easy":
-            self.max_iterations = 10
-        elif self.difficulty == "Normal":
-            self.max_iterations = 100
-        elif self.difficulty == "Hard":
-            self.max_iterations = 200
+        # determines how many monte carlo tree search iterations are performed, based on difficulty
+        # of AI and the calibrated speed of this machine
+        self.max_iterations = calibration.get_budget(self.difficulty)
+
+        # statistics from the most recent search, used for debugging and profiling
+        self.stats = None
 
-    def get_move(self, state):
+    def get_move(self, state, callback=None):
         # creates monte carlo tree search object
-        game_tree = MCTS(self.max_iterations, self.colour)
+        game_tree = MCTS(self.max_iterations, self.colour, callback=callback, rollout_depth=ROLLOUT_DEPTH,
+                         evaluator=get_evaluator())
 
         # uses a copy of the current board object to search for best move
-        return game_tree.search(copy.deepcopy(state))
+        move, self.stats = game_tree.search(state.copy_position(), with_stats=True)
+        return move
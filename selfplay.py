@@ -0,0 +1,227 @@
+import argparse
+import copy
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from board import Board
+from montecarlo import MCTS
+
+# --- constants ---
+
+# every position is stored as a fixed size record so any position can be found from its number
+RECORD = np.dtype([
+    ("dark", "<u8"), # bitboard of dark disks
+    ("light", "<u8"), # bitboard of light disks
+    ("to_move", "u1"), # 0 if dark disks are to be placed, 1 if light disks are
+    ("score", "i1"), # final disk difference for the player to move
+    ("visits", "<u2", (64,)) # number of search visits to each square's move
+])
+
+# each entry of the index file is the number of the first record of a game
+INDEX = np.dtype("<u8")
+
+COLOURS = ["D", "L"]
+
+# maximum number of visits that can be stored for a single move
+MAX_VISITS = np.iinfo(np.uint16).max
+
+# number of consecutive records read from the store at once when training
+BATCH_SIZE = 4096
+
+# --- classes ---
+
+# a file of position records with an index file containing the number of the first record of each game
+# records are appended to the end of the file and read through a memory map, so the positions are
+# never all held in memory
+class PositionStore:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.records = None
+        self.index = None
+
+    def append_game(self, records):
+        # the game's first record number is written to the index before the records are added
+        self.repair()
+        start = len(self)
+        with open(self.index_path, "ab") as file:
+            file.write(np.array([start], dtype=INDEX).tobytes())
+        with open(self.path, "ab") as file:
+            file.write(np.ascontiguousarray(records, dtype=RECORD).tobytes())
+
+        # any existing memory map no longer covers the whole file
+        self.records = None
+        self.index = None
+
+    def repair(self):
+        # a write interrupted by a crash can leave part of a record at the end of the file, or a game
+        # in the index whose records were never written, both are removed so that new games line up
+        # with the index
+        # the memory maps are released first since a mapped file can't be truncated on every system
+        self.records = None
+        self.index = None
+
+        records = len(self)
+        truncate(self.path, records * RECORD.itemsize)
+
+        if os.path.exists(self.index_path):
+            count = os.path.getsize(self.index_path) // INDEX.itemsize
+            index = np.fromfile(self.index_path, dtype=INDEX, count=count)
+            games = int(np.searchsorted(index, records))
+            truncate(self.index_path, games * INDEX.itemsize)
+
+    def __len__(self):
+        # only whole records are counted
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // RECORD.itemsize
+
+    def open(self):
+        # maps the files into memory, the operating system only loads the pages which are read
+        if self.records is None:
+            self.records = map_file(self.path, RECORD)
+            self.index = map_file(self.index_path, INDEX)
+
+            # games whose records were never written are ignored
+            self.index = self.index[:np.searchsorted(self.index, len(self.records))]
+        return self.records
+
+    def games(self):
+        self.open()
+        return len(self.index)
+
+    def game(self, number):
+        # returns the records of a single game as a view of the memory map
+        records = self.open()
+        start = int(self.index[number])
+        if number + 1 < len(self.index):
+            end = int(self.index[number + 1])
+        else:
+            end = len(records)
+        return records[start:end]
+
+    def batch(self, start, size):
+        # returns a view of consecutive records, no positions are copied
+        return self.open()[start:start + size]
+
+    def sample(self, size, rng=random):
+        # returns a copy of records chosen at random from the whole store, unlike a batch the
+        # positions are mostly from different games
+        # the records are read in the order they are stored so the reads move through the file
+        records = self.open()
+        indices = sorted(rng.sample(range(len(records)), min(size, len(records))))
+        return records[indices]
+
+# --- functions ---
+
+def map_file(path, dtype):
+    # memory maps an array of records, an empty or missing file gives an empty array since
+    # numpy can't map a file with no data
+    # only whole records are mapped, so part of a record left by an interrupted write is ignored
+    if not os.path.exists(path) or os.path.getsize(path) < dtype.itemsize:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(os.path.getsize(path) // dtype.itemsize,))
+
+def truncate(path, size):
+    # cuts the file back to the passed size if it is longer
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, "r+b") as file:
+            file.truncate(size)
+
+def play_game(iterations, seed):
+    # runs in a worker process, plays a game where both players use the monte carlo tree search
+    # and returns a record for every position
+    random.seed(seed)
+    state = Board()
+    colour = "D"
+    positions = []
+    actions = state.valid_moves(colour)
+
+    while len(actions) > 0:
+        game_tree = MCTS(iterations, colour)
+        move = game_tree.search(copy.deepcopy(state))
+
+        visits = np.zeros(64, dtype="<u2")
+        for action, child in game_tree.root.children.items():
+            visits[(action[1] * 8) + action[0]] = min(child.n, MAX_VISITS)
+        positions.append((state.bitboards(), COLOURS.index(colour), visits))
+
+        state.place_disk(move, colour)
+        colour = "L" if colour == "D" else "D"
+        actions = state.valid_moves(colour)
+
+    difference = state.count_disks("D") - state.count_disks("L")
+
+    records = np.zeros(len(positions), dtype=RECORD)
+    for i, ((dark, light), to_move, visits) in enumerate(positions):
+        records[i]["dark"] = dark
+        records[i]["light"] = light
+        records[i]["to_move"] = to_move
+        records[i]["score"] = difference if to_move == 0 else -difference
+        records[i]["visits"] = visits
+    return records
+
+def generate(path, games, iterations=100, workers=None, seed=None):
+    # plays games in parallel worker processes, this process appends each game to the store as it
+    # finishes so that there is only ever one writer
+    store = PositionStore(path)
+    rng = random.Random(seed)
+    max_in_flight = (workers or os.cpu_count() or 1) * 2
+    positions = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for game in range(games):
+            if len(in_flight) >= max_in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                positions += write_games(store, finished)
+            in_flight.add(executor.submit(play_game, iterations, rng.getrandbits(32)))
+
+        finished, in_flight = wait(in_flight)
+        positions += write_games(store, finished)
+
+    return positions
+
+def write_games(store, futures):
+    positions = 0
+    for future in futures:
+        records = future.result()
+        store.append_game(records)
+        positions += len(records)
+    return positions
+
+def training_samples(records):
+    # converts records to the samples used to train the pattern evaluator
+    for record in records:
+        score = int(record["score"])
+        if score > 0:
+            result = 1.0
+        elif score < 0:
+            result = 0.0
+        else:
+            result = 0.5
+        yield (int(record["dark"]), int(record["light"])), COLOURS[record["to_move"]], result
+
+def training_batches(store, size=BATCH_SIZE, rng=random):
+    # yields every record in the store as batches of training samples, in a random order of batches
+    # each batch is read from the memory map only when it is needed
+    starts = list(range(0, len(store), size))
+    rng.shuffle(starts)
+    for start in starts:
+        yield training_samples(store.batch(start, size))
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate self-play positions for training")
+    parser.add_argument("-o", "--output", default="positions.bin")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    positions = generate(args.output, args.games, args.iterations, args.workers, args.seed)
+    store = PositionStore(args.output)
+    print("Added {0} positions, {1} positions from {2} games stored".format(positions, len(store),
+                                                                          store.games()))
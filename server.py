@@ -0,0 +1,328 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from math import ceil, isfinite
+from board import Board
+from montecarlo import MCTS
+
+# --- constants ---
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# default and maximum search budgets for a single AI move
+DEFAULT_ITERATIONS = 100
+MAX_ITERATIONS = 5000
+DEFAULT_TIME = 1.0
+MAX_TIME = 10.0
+
+# extra time allowed for a worker to return its move after its search time has run out
+GRACE_TIME = 2.0
+
+# number of recent AI move latencies kept to calculate percentiles
+LATENCY_SAMPLES = 1000
+
+# --- functions ---
+
+def search_position(moves, colour, iterations, max_time):
+    # runs in a worker process, rebuilds the board from its moves and searches it
+    state = Board()
+    for move, move_colour in moves:
+        state.place_disk(tuple(move), move_colour)
+
+    game_tree = MCTS(iterations, colour, max_time=max_time)
+    return game_tree.search(state)
+
+def percentile(samples, fraction):
+    if len(samples) == 0:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(ceil(fraction * len(ordered)) - 1, 0)]
+
+# --- classes ---
+
+class RequestError(Exception):
+    pass
+
+# the state of a single game hosted by the server
+class HostedGame:
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.b = Board()
+
+        # dark disks always move first
+        self.colour = "D"
+        self.actions = self.b.valid_moves(self.colour)
+
+        # set while an AI move is being searched so that no other move can be made at the same time
+        self.searching = False
+
+    def play(self, move):
+        move = tuple(move)
+        if move not in self.actions:
+            raise RequestError("invalid move")
+
+        self.b.place_disk(move, self.colour)
+        self.b.history.append((move, self.colour))
+
+        # changes the active colour and finds its valid moves, if there are none the game is over
+        self.colour = "L" if self.colour == "D" else "D"
+        self.actions = self.b.valid_moves(self.colour)
+
+    def as_dict(self):
+        return {
+            "game" : self.game_id,
+            "colour" : self.colour,
+            "moves" : [list(action) for action in self.actions],
+            "dark" : self.b.count_disks("D"),
+            "light" : self.b.count_disks("L"),
+            "over" : len(self.actions) == 0,
+            "winner" : self.b.get_winner() if len(self.actions) == 0 else None
+        }
+
+# serves many games at once, each client sends one json request per line and receives one json
+# response per line
+class GameServer:
+    def __init__(self, workers=None, max_in_flight=None, max_queued=64):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+
+        # limits the number of searches given to the process pool at once, and the number of
+        # requests allowed to wait for one, further AI requests are rejected until the queue drains
+        self.max_in_flight = max_in_flight or workers or os.cpu_count() or 1
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        self.max_queued = max_queued
+        self.queued = 0
+
+        self.games = {}
+        self.game_ids = itertools.count(1)
+
+        # counters used to report throughput and latency
+        self.started = time.perf_counter()
+        self.games_created = 0
+        self.moves_played = 0
+        self.ai_moves = 0
+        self.rejected = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    async def handle_request(self, request):
+        # performs a single request and returns the response, this can be called directly
+        # instead of through a socket
+        operations = {
+            "new" : self.new_game,
+            "state" : self.get_state,
+            "move" : self.make_move,
+            "ai" : self.ai_move,
+            "close" : self.close_game,
+            "stats" : self.get_stats
+        }
+
+        try:
+            if not isinstance(request, dict) or request.get("op") not in operations:
+                raise RequestError("unknown operation")
+            response = await operations[request["op"]](request)
+            response["ok"] = True
+        except RequestError as error:
+            response = {"ok" : False, "error" : str(error)}
+        except Exception as error:
+            # any other failure, such as a worker process dying, is still answered so that every
+            # request gets exactly one response
+            response = {"ok" : False, "error" : "internal error: {0}".format(type(error).__name__)}
+
+        # the request id is sent back so clients can match responses to requests
+        if isinstance(request, dict) and "id" in request:
+            response["id"] = request["id"]
+        return response
+
+    async def handle_line(self, line):
+        try:
+            request = json.loads(line)
+        except (ValueError, RecursionError):
+            return json.dumps({"ok" : False, "error" : "invalid json"})
+        return json.dumps(await self.handle_request(request))
+
+    async def handle_client(self, reader, writer):
+        # each request is handled in its own task so a slow AI move doesn't block the client's other games
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(line):
+            response = await self.handle_line(line)
+            async with lock:
+                writer.write(response.encode() + b"\n")
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(respond(line))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    def get_game(self, request):
+        # game ids are integers, other values such as lists can't be looked up and booleans would
+        # be treated as the games with ids 0 and 1
+        game_id = request.get("game")
+        if not isinstance(game_id, int) or isinstance(game_id, bool):
+            raise RequestError("unknown game")
+        game = self.games.get(game_id)
+        if game is None:
+            raise RequestError("unknown game")
+        return game
+
+    async def new_game(self, request):
+        game = HostedGame(next(self.game_ids))
+        self.games[game.game_id] = game
+        self.games_created += 1
+        return game.as_dict()
+
+    async def get_state(self, request):
+        return self.get_game(request).as_dict()
+
+    async def close_game(self, request):
+        game = self.get_game(request)
+        del self.games[game.game_id]
+        return {"game" : game.game_id}
+
+    async def make_move(self, request):
+        game = self.get_game(request)
+        if game.searching:
+            raise RequestError("ai move in progress")
+
+        try:
+            game.play(request.get("move"))
+        except TypeError:
+            raise RequestError("invalid move")
+        self.moves_played += 1
+        return game.as_dict()
+
+    async def ai_move(self, request):
+        game = self.get_game(request)
+        if game.searching:
+            raise RequestError("ai move in progress")
+        if len(game.actions) == 0:
+            raise RequestError("game is over")
+
+        try:
+            iterations = int(request.get("iterations", DEFAULT_ITERATIONS))
+            max_time = float(request.get("time", DEFAULT_TIME))
+        except (TypeError, ValueError, OverflowError):
+            raise RequestError("invalid budget")
+
+        # float also accepts "nan" and "inf", which like budgets of zero or less can't limit a search
+        if (iterations < 1) or not isfinite(max_time) or (max_time <= 0):
+            raise RequestError("invalid budget")
+        iterations = min(iterations, MAX_ITERATIONS)
+        max_time = min(max_time, MAX_TIME)
+
+        # backpressure: if too many requests are already waiting for the pool, the client is told to retry
+        if self.queued >= self.max_queued:
+            self.rejected += 1
+            raise RequestError("busy")
+
+        start = time.perf_counter()
+        game.searching = True
+        self.queued += 1
+        waiting = True
+        try:
+            await self.in_flight.acquire()
+            self.queued -= 1
+            waiting = False
+
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, search_position, game.b.history,
+                                          game.colour, iterations, max_time)
+
+            # the slot is only given back once the worker has finished the search, a request that
+            # times out stops waiting for it but the worker is still busy until then
+            future.add_done_callback(self.search_finished)
+            try:
+                move = await asyncio.wait_for(asyncio.shield(future), max_time + GRACE_TIME)
+            except asyncio.TimeoutError:
+                raise RequestError("search timed out")
+        finally:
+            if waiting:
+                self.queued -= 1
+            game.searching = False
+
+        self.latencies.append(time.perf_counter() - start)
+        self.ai_moves += 1
+
+        # the game may have been closed while its move was being searched
+        if self.games.get(game.game_id) is not game:
+            raise RequestError("unknown game")
+
+        game.play(move)
+        self.moves_played += 1
+        response = game.as_dict()
+        response["move"] = list(move)
+        return response
+
+    def search_finished(self, future):
+        self.in_flight.release()
+
+        # the result of a search that timed out is never read, so its error is read here instead
+        # of being reported as unhandled
+        if not future.cancelled():
+            future.exception()
+
+    async def get_stats(self, request):
+        return self.stats()
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        p99 = percentile(self.latencies, 0.99)
+        return {
+            "uptime" : elapsed,
+            "active_games" : len(self.games),
+            "games_created" : self.games_created,
+            "games_per_second" : self.games_created / elapsed,
+            "moves_played" : self.moves_played,
+            "moves_per_second" : self.moves_played / elapsed,
+            "ai_moves" : self.ai_moves,
+            "ai_p99_latency" : p99,
+            "queued" : self.queued,
+            "rejected" : self.rejected
+        }
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle_client, host, port)
+        print("Serving on {0}:{1}".format(host, port))
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+# --- main ---
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Host many Othello games over a line-delimited json protocol")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument("--max-queued", type=int, default=64)
+    args = parser.parse_args()
+
+    game_server = GameServer(args.workers, args.max_in_flight, args.max_queued)
+    try:
+        asyncio.run(game_server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(game_server.stats()))
+        game_server.shutdown()